@@ -0,0 +1,255 @@
+"""
+Batch analysis of recorded sessions
+
+Runs the same guidance the RealSense viewer prints (getAllObject,
+findLongestStreak, translateToWords) over many recordings at once, one
+recording per worker process, and writes the per-frame results plus a
+per-recording timing summary to CSV (or Parquet when pandas is installed).
+
+Usage:
+------
+    python BatchAnalysis.py walks/*.bag -o results.csv
+    python BatchAnalysis.py walks/*.npz -o results.parquet --workers 8 --every 5
+    python BatchAnalysis.py walks/*.bag --compact --trace-memory
+    python BatchAnalysis.py walks/*.bag --backend numpy
+
+This writes results.csv with one row per analysed frame and
+results_summary.csv with one row per recording.
+"""
+
+import argparse
+import csv
+import importlib.util
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import DepthKernels
+from DepthAnalysis import findLongestStreak, translateToWords
+from DepthKernels import findObjects
+from FrameSource import openRecording
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the summary just leaves out the peak RSS
+    resource = None
+
+
+#This runs detection and direction finding on every frame of one recording
+#It lives at module level so the worker processes can import it
+#compact runs detection on the raw integer depth instead of meters
+#traceMemory records how much each frame allocates, which slows everything down a little
+#backend picks the DepthKernels backend, None keeps the default
+def analyseRecording(path, decimateLevel, maxDiff, every, maxFrames, compact=False, traceMemory=False, backend=None):
+    if backend is not None:
+        DepthKernels.setBackend(backend)
+    frameRows = []
+    if traceMemory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    firstTimestamp = lastTimestamp = None
+
+    for frameIndex, timestamp, depth_image, depth_scale in openRecording(path, decimateLevel):
+        if maxFrames is not None and frameIndex >= maxFrames:
+            break
+        if firstTimestamp is None:
+            firstTimestamp = timestamp
+        lastTimestamp = timestamp
+        if frameIndex % every != 0:
+            continue
+
+        if traceMemory:
+            tracemalloc.reset_peak()
+            allocatedBefore = tracemalloc.get_traced_memory()[0]
+
+        ingestStart = time.perf_counter()
+        if compact:
+            depthArray = depth_image
+            frameMaxDiff = maxDiff / depth_scale
+        else:
+            depthArray = depth_image * depth_scale
+            frameMaxDiff = maxDiff
+        height, width = depth_image.shape
+
+        detectStart = time.perf_counter()
+        objectList = findObjects(depthArray, frameMaxDiff)
+
+        directionStart = time.perf_counter()
+        moveDecimal = findLongestStreak(objectList, width)
+        direction = translateToWords(moveDecimal)
+        directionEnd = time.perf_counter()
+
+        frameRow = {
+            "recording": path,
+            "frame": frameIndex,
+            "timestamp_ms": timestamp,
+            "width": width,
+            "height": height,
+            "object_count": len(objectList),
+            "objects": repr(objectList),
+            "move_decimal": moveDecimal,
+            "direction": direction,
+            "ingest_ms": (detectStart - ingestStart) * 1000,
+            "detect_ms": (directionStart - detectStart) * 1000,
+            "direction_ms": (directionEnd - directionStart) * 1000,
+        }
+        if traceMemory:
+            frameRow["allocated_kb"] = (tracemalloc.get_traced_memory()[1] - allocatedBefore) / 1024
+        frameRows.append(frameRow)
+        #Drop this frame's depth before the next one is read, so the peaks don't overlap
+        depthArray = None
+
+    wallSeconds = time.perf_counter() - started
+    if traceMemory:
+        tracemalloc.stop()
+    return frameRows, summariseRecording(path, frameRows, wallSeconds, firstTimestamp, lastTimestamp, traceMemory)
+
+
+#Runs once in every worker before its first recording, so compiling the kernels
+#isn't counted in the first frame's detect_ms
+def startWorker(backend):
+    DepthKernels.setBackend(backend)
+    DepthKernels.warmUp()
+
+
+#Largest resident set of this worker so far in MB
+#Only meaningful when the worker analyses a single recording, see main
+def peakRssMegabytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if os.uname().sysname == "Darwin" else maxrss / 1024
+
+
+def summariseRecording(path, frameRows, wallSeconds, firstTimestamp, lastTimestamp, traceMemory=False):
+    frames = len(frameRows)
+    recordedSeconds = (lastTimestamp - firstTimestamp) / 1000 if frames > 0 else 0.0
+    summary = {
+        "recording": path,
+        "frames": frames,
+        "wall_s": wallSeconds,
+        "recorded_s": recordedSeconds,
+        "fps": frames / wallSeconds if wallSeconds > 0 else 0.0,
+        "realtime_factor": recordedSeconds / wallSeconds if wallSeconds > 0 else 0.0,
+    }
+    columns = ["ingest_ms", "detect_ms", "direction_ms"]
+    if traceMemory:
+        summary["peak_rss_mb"] = peakRssMegabytes()
+        # even for recordings without frames, so every summary row has the same columns
+        columns.append("allocated_kb")
+    for column in columns:
+        values = [row[column] for row in frameRows]
+        summary[column + "_mean"] = sum(values) / frames if frames > 0 else 0.0
+        summary[column + "_max"] = max(values) if frames > 0 else 0.0
+    return summary
+
+
+#None if rows can be written to path, else why not
+#Checked before any recording is analysed so a long batch doesn't fail at the very end
+def outputProblem(path):
+    if not path.lower().endswith(".parquet"):
+        return None
+    def installed(name):
+        return importlib.util.find_spec(name) is not None
+    if not installed("pandas") or not (installed("pyarrow") or installed("fastparquet")):
+        return "writing " + path + " needs pandas and pyarrow, use a .csv output instead"
+    return None
+
+
+#Writes a list of dicts as CSV, or as Parquet if the file name ends in .parquet
+def writeTable(rows, path):
+    if path.lower().endswith(".parquet"):
+        import pandas
+        pandas.DataFrame(rows).to_parquet(path, index=False)
+        return
+    with open(path, "w", newline="") as outFile:
+        if len(rows) == 0:
+            return
+        #Every key that shows up in any row, in the order they first appear
+        fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+        writer = csv.DictWriter(outFile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def summaryPath(outputPath):
+    root, extension = os.path.splitext(outputPath)
+    return root + "_summary" + extension
+
+
+#argparse type for counts that must be at least 1
+def positiveInt(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got " + repr(value))
+    return number
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Run obstacle detection and direction finding over recorded sessions.")
+    parser.add_argument("recordings", nargs="+", help=".bag or .npz recordings to analyse (RealSense or Kinect)")
+    parser.add_argument("-o", "--output", default="results.csv", help="per-frame results (.csv or .parquet)")
+    parser.add_argument("-j", "--workers", type=positiveInt, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--decimate", type=int, default=2, choices=(0, 1, 2), help="decimation level, same as the [d] key in the viewer")
+    parser.add_argument("--max-diff", type=float, default=1, help="largest depth jump in meters between pixels of one object")
+    parser.add_argument("--every", type=positiveInt, default=1, help="only analyse every n-th frame")
+    parser.add_argument("--max-frames", type=positiveInt, default=None, help="stop each recording after this many frames")
+    parser.add_argument("--compact", action="store_true", help="run detection on raw integer depth instead of floats in meters")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record how much memory each frame allocates and each recording's peak RSS")
+    parser.add_argument("--backend", choices=sorted(DepthKernels.backends), default=DepthKernels.backend,
+                        help="detection kernels, numba falls back to numpy when it is not installed")
+    args = parser.parse_args(argv)
+    problem = outputProblem(args.output)
+    if problem is not None:
+        parser.error(problem)
+    return args
+
+
+def main(argv=None):
+    args = parseArguments(argv)
+    allFrames = []
+    summaries = []
+    started = time.perf_counter()
+
+    poolOptions = {}
+    if args.trace_memory:
+        #A fresh worker for every recording, otherwise peak_rss_mb would include the recordings it analysed before
+        poolOptions["max_tasks_per_child"] = 1
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=startWorker, initargs=(args.backend,),
+                             **poolOptions) as pool:
+        jobs = {pool.submit(analyseRecording, path, args.decimate, args.max_diff, args.every, args.max_frames,
+                            args.compact, args.trace_memory, args.backend): path
+                for path in args.recordings}
+        for job in as_completed(jobs):
+            path = jobs[job]
+            try:
+                frameRows, summary = job.result()
+            except Exception as error:
+                print("Skipping " + path + ": " + repr(error))
+                continue
+            allFrames += frameRows
+            summaries.append(summary)
+            print("%s: %d frames, %.1f FPS, %.1fx real time" %
+                  (path, summary["frames"], summary["fps"], summary["realtime_factor"]))
+
+    wallSeconds = time.perf_counter() - started
+    #Keep the output in a stable order no matter which worker finished first
+    allFrames.sort(key=lambda row: (row["recording"], row["frame"]))
+    summaries.sort(key=lambda row: row["recording"])
+    writeTable(allFrames, args.output)
+    writeTable(summaries, summaryPath(args.output))
+
+    recordedSeconds = sum(summary["recorded_s"] for summary in summaries)
+    print("====================================================")
+    print("%d recordings, %d frames in %.2fs (%.1f FPS, %.1fx real time)" %
+          (len(summaries), len(allFrames), wallSeconds,
+           len(allFrames) / wallSeconds if wallSeconds > 0 else 0.0,
+           recordedSeconds / wallSeconds if wallSeconds > 0 else 0.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Obstacle detection and direction finding on depth frames
+
+These are the routines the RealSense viewer (RealStream.py) runs on the live
+camera. They only need a 2D depth array (rows of distances in meters, or of
+raw depth units) and something with a width and height, so they can also be
+imported on their own without starting a camera, e.g. for offline analysis of
+recorded sessions. The viewer and BatchAnalysis call them through
+DepthKernels.findObjects, which runs a compiled copy when numba is installed.
+"""
+
+from array import array
+from collections import namedtuple
+
+
+#Stand-in for rs.intrinsics when all we know is the size of the depth array
+FrameSize = namedtuple("FrameSize", ["width", "height"])
+
+
+class FoundObject(object):
+    def __init__(self, row, col):
+        self.bigRow = row
+        self.bigCol = col
+        self.smallRow = row
+        self.smallCol = col
+    #This adds a point to the found object
+    def addPoint(self, newRow, newCol):
+        if self.bigRow < newRow:
+            self.bigRow = newRow
+        elif self.smallRow > newRow:
+            self.smallRow = newRow
+        if self.bigCol < newCol:
+            self.bigCol = newCol
+        elif self.smallCol > newCol:
+            self.smallCol = newCol
+    #THis determines if a column is between, on the left, or on the right of an object
+    def isBetween(self, newCol):
+        if newCol > self.smallCol:
+            if newCol < self.bigCol:
+                return True
+            else:
+                return "right"
+        else:
+            return "left"
+    def __repr__(self):
+        return "Row between " + repr(self.smallRow) + " and " + repr(self.bigRow) + ", col between " + repr(self.smallCol) + ", " + repr(self.bigCol)
+            
+#You dont have to search top-left directions
+searchingPattern = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+'''
+def getAllObject(gameState, depth_intrinsics, maxDiff):
+    objectList = []
+#    for row in range(depth_intrinsics.height):
+#        for col in range(depth_intrinsics.row):
+    for row in range(depth_intrinsics[0]):
+        for col in range(depth_intrinsics[1]):
+            if gameState[row][col] != 0:
+                currentObject = FoundObject(row, col)
+                gameState, currentObject = getAllSurrounding(gameState, currentObject, row, col, maxDiff, searchingPattern, depth_intrinsics)
+                objectList += [currentObject]
+    return objectList
+'''
+
+#This method returns the object's biggest col num if the targetcol is found to be within an object, else it returns -1
+def binarySearchObject(objectList, targetCol):
+    if len(objectList) == 0:
+        return -1
+    left = 0
+    right = len(objectList)-1
+    mid = (left+right)//2
+#    print("left = " + repr(left))
+#    print("right = " + repr(right))
+#    print("mid = " + repr(mid))
+#    print("objectList = " + repr(objectList))
+#    print("targetCol = " + repr(targetCol))
+    while right - left > 1:
+#        print("left = " + repr(left))
+#        print("right = " + repr(right))
+#        print("mid = " + repr(mid))
+        '''
+        currentCol = objectList[mid].smallCol
+        if currentCol == targetCol:
+            return objectList[mid].bigCol
+        elif currentCol < targetCol:
+            left = mid
+            mid = (left+right)//2
+        elif currentCol > targetCol:
+            right = mid
+            mid = (left+right)//2
+        else:
+            print("ERRRORRRRRR")
+        '''
+        compare = objectList[mid].isBetween(targetCol)
+        if compare == True:
+            return objectList[mid].bigCol
+        elif compare == "left":
+            right = mid
+            mid = (left+right)//2
+        elif compare == "right":
+            left = mid
+            mid = (left+right)//2
+        else:
+            print("ERRRORRRRR")
+    '''
+    if objectList[left].smallCol == targetCol:
+        print("lies within object of " + repr(objectList[left]))
+        return objectList[left].bigCol
+    elif objectList[right].smallCol == targetCol:
+        print("lies within object of " + repr(objectList[right]))
+        return objectList[right].bigCol
+    '''
+    if objectList[left].isBetween(targetCol) == True:
+#        print("object = " + repr(objectList[left]))
+#        print("targetCol = " + repr(targetCol))
+#        print("isBetween = " + repr(objectList[left].isBetween(targetCol)))
+#        print("lies within object of " + repr(objectList[left]))
+        return objectList[left].bigCol
+    elif objectList[right].isBetween(targetCol) == True:
+#        print("lies within object of " + repr(objectList[right]))
+        return objectList[right].bigCol
+    return -1
+
+#This method inserts another object into an objectList in order (binary search and insert)
+def binaryInsertObject(objectList, currentObject):
+    if len(objectList) == 0:
+        objectList += [currentObject]
+        return objectList
+    left = 0
+    right = len(objectList) - 1
+    mid = (left + right) // 2
+    while left - right > 1:
+        
+        if left == right:
+            if objectList[left].smallCol > currentObject.smallCol:
+                objectList.insert(left, currentObject)
+            else:
+                objectList.insert(left+1, currentObject)
+        if left > right:
+            objectList.insert(left, currentObject)
+        
+        currentCol = objectList[mid].smallCol
+        if currentCol < currentObject.smallCol:
+            left = mid + 1
+            mid = (left + right) // 2
+        elif currentCol > currentObject.smallCol:
+            right = mid - 1
+            mid = (left + right) // 2
+        else:
+            print("INSERT ERRORRR")
+            
+    if objectList[left].smallCol < currentObject.smallCol:
+        if objectList[right].smallCol < currentObject.smallCol:
+            objectList.insert(right + 1, currentObject)
+        else:
+            objectList.insert(right, currentObject)
+    else:
+        objectList.insert(left, currentObject)
+    '''
+    if objectList[left].smallCol > currentObject.smallCol:
+        objectList.insert(left, currentObject)
+    elif objectList[left].smallCol < currentObject.smallCol:
+        objectList.insert(left + 1, currentObject)
+    '''
+    return objectList
+
+
+#This method sets every point within the smallCol to bigCol to become zero
+def setColRangeToZero(gameState, smallCol, bigCol):
+    length = len(gameState)
+    for row in range(length):
+        for col in range(smallCol, bigCol + 1):
+            gameState[row][col] = 0;
+    return gameState
+
+#This method gets all the objects in a given game state
+def getAllObject(gameState, depth_intrinsics, maxDiff):
+    objectList = []
+#    for row in range(depth_intrinsics.height):
+#        for col in range(depth_intrinsics.row):
+    row = 0
+    col = 0
+    while row < depth_intrinsics.height:
+        while col < depth_intrinsics.width:
+#            print("----------------------------------------------------------------")
+#            print("We are checking row: " + repr(row) + " and col: " + repr(col))
+            if gameState[row][col] != 0:
+#                print("Point value is " + repr(gameState[row][col]))
+                currentObject = FoundObject(row, col)
+#                print("gameState before is \n" + repr(gameState))
+                gameState, currentObject = getAllSurrounding(gameState, currentObject, row, col, maxDiff, searchingPattern, depth_intrinsics, 0)
+                #In case there is a glitch in the detection, where there is only one point 
+#                print("gameState after is \n" + repr(gameState))
+#                print("currentObject Found is " + repr(currentObject))
+                col += 1
+                if currentObject.bigCol - currentObject.smallCol >=2:
+#                    print("objectList before is " + repr(objectList))
+                    objectList = binaryInsertObject(objectList, currentObject)
+#                    print("objectList after is " + repr(objectList))
+                    #This sets everything within these columns to become zero
+#                    print("gameState changed from \n" + repr(gameState))
+                    gameState = setColRangeToZero(gameState, currentObject.smallCol, currentObject.bigCol)
+#                    print("to \n" + repr(gameState))
+#                else:
+#                    print("object ignored because its too small")
+            else:
+#                print("point has a value of zero")
+                tempCol = binarySearchObject(objectList, col)
+                
+                if tempCol == -1:
+ #                   print("lies in no object")
+                    col += 1
+                    continue
+                else:
+#                    print("cols jumpting from " + repr(col) + " to " + repr(tempCol))
+                    col = tempCol
+                    col += 1
+#        print("NEXT ROW ===============================================================")
+        col = 0
+        row += 1
+    return objectList
+
+
+#This gets all the surrounding pixels that have a close depth value to the target pixel
+#Uses recursion, and it always deletes the currentRow and currentCol, dosn't delete the next ones
+def getAllSurrounding(gameState, currentObject, currentRow, currentCol, maxDiff, searchingPattern, depth_intrinsics, count):
+    if count > 80:
+        return
+    currentValue = gameState[currentRow][currentCol]
+    gameState[currentRow][currentCol] = 0
+#    print("BASEEEE = " + repr(currentRow) + ", " + repr(currentCol))
+    for currentDirection in searchingPattern:
+        addRow, addCol = currentDirection
+        newRow = currentRow + addRow
+        newCol = currentCol + addCol
+#        print("now searching + " + repr(newRow) + " and " + repr(newCol))
+#        if newCol < 0 or newCol >= depth_intrinsics.width or newRow < 0 or newRow >= depth_intrinsics.height:
+        if newCol < 0 or newCol >= depth_intrinsics.width or newRow < 0 or newRow >= depth_intrinsics.height:
+#            print("skipped because out of bounds on row of " + repr(newRow) + ", and col of " + repr(newCol))
+            continue
+        newValue = gameState[newRow][newCol]
+        if newValue == 0:
+            
+            continue
+        
+        if abs(newValue - currentValue) <= maxDiff:
+#            print("MATCH")
+            currentObject.addPoint(newRow, newCol)
+            getAllSurrounding(gameState, currentObject, newRow, newCol, maxDiff, searchingPattern, depth_intrinsics, count+1)
+    return gameState, currentObject
+
+def testGetAllSurrounding():
+    '''
+    gameState = [[0, 0, 0, 0, 4, 6, 5, 6, 8, 14, 13, 0, 0], 
+                 [0, 0, 0, 3, 3, 5, 3, 3, 5, 11, 16, 10, 0], 
+                 [0, 0, 0, 0, 2, 4, 5, 5, 4, 13, 14, 13, 0],
+                 [0, 0, 0, 5, 4, 3, 5, 2, 4, 14, 13, 15, 0]]
+#    currentObject = FoundObject(0, 4)
+    maxDiff = 2
+    depth_intrinsics = (4, 13)
+#    print("GameState before = \n" + repr(gameState))
+#    getAllSurrounding(gameState, currentObject, 0, 4, maxDiff, searchingPattern, depth_intrinsics)
+#    print("GameState after = \n" + repr(gameState))
+#    print(currentObject)
+    print(gameState)
+    objectList = getAllObject(gameState, depth_intrinsics, maxDiff)
+    print(gameState)
+    print(objectList)
+    
+    
+    
+    gameState = [[2, 0, 4, 0, 6, 0, 8, 0, 10], 
+                 [0, 12, 0, 14, 0, 16, 0, 18, 0], 
+                 [20, 0, 22, 0, 24, 0, 26, 0, 28],
+                 [0, 30, 0, 32, 0, 34, 0, 36, 0]]
+#    currentObject = FoundObject(0, 4)
+    maxDiff = 2
+    depth_intrinsics = (4, 9)
+#    print("GameState before = \n" + repr(gameState))
+#    getAllSurrounding(gameState, currentObject, 0, 4, maxDiff, searchingPattern, depth_intrinsics)
+#    print("GameState after = \n" + repr(gameState))
+#    print(currentObject)
+    print(gameState)
+    objectList = getAllObject(gameState, depth_intrinsics, maxDiff)
+    print(gameState)
+    print(objectList)
+    '''
+    gameState = [[0.0, 0.0, 0.54, 0.83, 0.64, 1.1, 1.23, 1.21, 0.0, 0.0, 0.0], 
+                 [0.0, 0.0, 0.23, 0.38, 0.45, 0.98, 1.07, 1.14, 1.21, 0.0, 0.0], 
+                 [0.0, 0.32, 0.31, 0.42, 0.0, 0.0, 1.1, 1.21, 1.32, 1.23, 0.0],
+                 [0.0, 0.0, 0.35, 0.37, 0.52, 0.0, 0.0, 1.09, 1.27, 1.25, 1.22]]
+#    currentObject = FoundObject(0, 4)
+    maxDiff = 0.2
+    depth_intrinsics = (4, 11)
+#    print("GameState before = \n" + repr(gameState))
+#    getAllSurrounding(gameState, currentObject, 0, 4, maxDiff, searchingPattern, depth_intrinsics)
+#    print("GameState after = \n" + repr(gameState))
+#    print(currentObject)
+    print(gameState)
+    objectList = getAllObject(gameState, depth_intrinsics, maxDiff)
+    print(gameState)
+    print(objectList)
+    
+    
+
+#testGetAllSurrounding()
+
+
+
+#This method finds the longest streak of empty spaces and returns the degree to which someone should turn (0 to 1)
+#width is the number of columns the objects were found in (160 at the viewer's default decimation)
+def findLongestStreak(objectList, width=160):
+    longestStreak = -1
+    streakPosition = -1
+    totalObject = len(objectList)
+    for objectIndex in range(1, totalObject):
+        currentDif = objectList[objectIndex].smallCol - objectList[objectIndex - 1].bigCol
+        if currentDif > longestStreak:
+            longestStreak = currentDif
+            streakPosition = (objectList[objectIndex].smallCol + objectList[objectIndex - 1].bigCol)//2
+    return streakPosition / width
+
+def translateToWords(moveDecimal):
+    if moveDecimal <= 0.5:
+        return "right"
+    else:
+        return "left"
+
+
+#This turns a z16 depth image into rows getAllObject can search, one array('H') per row
+#(2 bytes a pixel instead of a Python float). maxDiff has to be in raw units too (maxDiff / depth_scale)
+def depthImageToRows(depth_image):
+    return [array('H', row.tobytes()) for row in depth_image.astype('uint16', copy=False)]
@@ -0,0 +1,363 @@
+"""
+Compiled kernels for detection and point cloud rendering
+
+The region growing in getAllObject and the per-point drawing in pointcloud()
+are loops over pixels and points, which is slow in Python and awkward in numpy.
+When numba is installed they are compiled instead (compilation is cached on
+disk, so only the very first run pays for it). Without numba the same calls
+fall back to the original implementations:
+
+    findObjects   getAllObject (DepthAnalysis) on lists of floats for depth in
+                  meters, or on depthImageToRows for raw integer depth
+    splatPoints   the viewer's original painter's algorithm: sort from back to front
+                  and scatter, so the nearest point is written last
+
+Both backends give exactly the same results, see test_DepthKernels.py.
+
+The backend is picked when this module is imported ("numba" if it can be
+imported, else "numpy"); set DEPTHSENSE_KERNELS=numpy to force the fallback, or
+call setBackend. Call warmUp before timing anything, so compiling (a few
+seconds the first time, a fraction of one from the cache) isn't counted
+against the first frame.
+
+Usage:
+------
+    python DepthKernels.py      times both backends
+"""
+
+import os
+import time
+import numpy as np
+
+from DepthAnalysis import FoundObject, FrameSize, depthImageToRows, getAllObject
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+#Deepest the region growing goes, the same limit as getAllSurrounding
+MAX_SEARCH_DEPTH = 80
+
+#(row, col) steps to the 8 neighbours, in the same order as searchingPattern
+SEARCH_ROWS = np.array([-1, -1, -1, 0, 0, 1, 1, 1], dtype=np.int64)
+SEARCH_COLS = np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.int64)
+
+
+#----------------------------------------------------------------------------------
+#These are written so numba can compile them, and follow getAllObject, getAllSurrounding,
+#binarySearchObject and binaryInsertObject step by step so the objects come out identical.
+#Objects are kept as four arrays (smallRow, bigRow, smallCol, bigCol) sorted like objectList.
+
+
+#Same as FoundObject.isBetween: 0 for inside, 1 for left, 2 for right
+def isBetweenKernel(smallCol, bigCol, newCol):
+    if newCol > smallCol:
+        if newCol < bigCol:
+            return 0
+        return 2
+    return 1
+
+
+def binarySearchKernel(smallCols, bigCols, count, targetCol):
+    if count == 0:
+        return -1
+    left = 0
+    right = count - 1
+    mid = (left + right) // 2
+    while right - left > 1:
+        compare = isBetweenKernel(smallCols[mid], bigCols[mid], targetCol)
+        if compare == 0:
+            return bigCols[mid]
+        elif compare == 1:
+            right = mid
+        else:
+            left = mid
+        mid = (left + right) // 2
+    if isBetweenKernel(smallCols[left], bigCols[left], targetCol) == 0:
+        return bigCols[left]
+    elif isBetweenKernel(smallCols[right], bigCols[right], targetCol) == 0:
+        return bigCols[right]
+    return -1
+
+
+def insertKernel(bounds, count, smallRow, bigRow, smallCol, bigCol):
+    # binaryInsertObject only ever looks at the first and last object
+    if count == 0:
+        position = 0
+    elif bounds[0, 2] < smallCol:
+        if bounds[count - 1, 2] < smallCol:
+            position = count
+        else:
+            position = count - 1
+    else:
+        position = 0
+    for index in range(count, position, -1):
+        bounds[index, :] = bounds[index - 1, :]
+    bounds[position, 0] = smallRow
+    bounds[position, 1] = bigRow
+    bounds[position, 2] = smallCol
+    bounds[position, 3] = bigCol
+
+
+#getAllSurrounding without recursion: the stack holds what each recursive call would have
+#in its local variables, and its index is the call's count
+def growKernel(gameState, startRow, startCol, maxDiff, searchRows, searchCols, box):
+    height, width = gameState.shape
+    stackRows = np.empty(MAX_SEARCH_DEPTH + 1, dtype=np.int64)
+    stackCols = np.empty(MAX_SEARCH_DEPTH + 1, dtype=np.int64)
+    stackValues = np.empty(MAX_SEARCH_DEPTH + 1, dtype=gameState.dtype)
+    stackDirections = np.empty(MAX_SEARCH_DEPTH + 1, dtype=np.int64)
+
+    top = 0
+    stackRows[0] = startRow
+    stackCols[0] = startCol
+    stackValues[0] = gameState[startRow, startCol]
+    stackDirections[0] = 0
+    gameState[startRow, startCol] = 0
+
+    while top >= 0:
+        direction = stackDirections[top]
+        if direction == 8:
+            top -= 1
+            continue
+        stackDirections[top] = direction + 1
+        newRow = stackRows[top] + searchRows[direction]
+        newCol = stackCols[top] + searchCols[direction]
+        if newCol < 0 or newCol >= width or newRow < 0 or newRow >= height:
+            continue
+        newValue = gameState[newRow, newCol]
+        if newValue == 0:
+            continue
+        # as floats, so raw uint16 depth can't wrap around when subtracting
+        if abs(float(newValue) - float(stackValues[top])) <= maxDiff:
+            # FoundObject.addPoint, elifs included
+            if box[1] < newRow:
+                box[1] = newRow
+            elif box[0] > newRow:
+                box[0] = newRow
+            if box[3] < newCol:
+                box[3] = newCol
+            elif box[2] > newCol:
+                box[2] = newCol
+            # a call with a count over the limit returns straight away
+            if top + 1 > MAX_SEARCH_DEPTH:
+                continue
+            top += 1
+            stackRows[top] = newRow
+            stackCols[top] = newCol
+            stackValues[top] = newValue
+            stackDirections[top] = 0
+            gameState[newRow, newCol] = 0
+
+
+#getAllObject, returns the number of objects, their bounds are in the first rows of bounds
+def findObjectsKernel(gameState, maxDiff, searchRows, searchCols, bounds):
+    height, width = gameState.shape
+    count = 0
+    box = np.empty(4, dtype=np.int64)
+    row = 0
+    while row < height:
+        col = 0
+        while col < width:
+            if gameState[row, col] != 0:
+                box[0] = row
+                box[1] = row
+                box[2] = col
+                box[3] = col
+                growKernel(gameState, row, col, maxDiff, searchRows, searchCols, box)
+                col += 1
+                if box[3] - box[2] >= 2:
+                    insertKernel(bounds, count, box[0], box[1], box[2], box[3])
+                    count += 1
+                    gameState[:, box[2]:box[3] + 1] = 0
+            else:
+                tempCol = binarySearchKernel(bounds[:, 2], bounds[:, 3], count, col)
+                if tempCol == -1:
+                    col += 1
+                else:
+                    col = tempCol + 1
+        row += 1
+    return count
+
+
+#Draws each point with the colour of the nearest point that lands on the same pixel
+#(what the painter's algorithm does, ties go to the point that comes first)
+def splatKernel(out, rows, cols, depth, colors):
+    height, width = out.shape[:2]
+    nearest = np.full((height, width), np.inf, dtype=np.float32)
+    winner = np.full((height, width), -1, dtype=np.int64)
+    for index in range(rows.shape[0]):
+        row = rows[index]
+        col = cols[index]
+        if row >= height or col >= width:
+            continue
+        if depth[index] < nearest[row, col]:
+            nearest[row, col] = depth[index]
+            winner[row, col] = index
+    for row in range(height):
+        for col in range(width):
+            index = winner[row, col]
+            if index >= 0:
+                out[row, col, :] = colors[index, :]
+
+
+#----------------------------------------------------------------------------------
+
+
+def findObjectsNumpy(depth, maxDiff):
+    depth = np.asarray(depth)
+    frameSize = FrameSize(depth.shape[1], depth.shape[0])
+    if np.issubdtype(depth.dtype, np.integer):
+        return getAllObject(depthImageToRows(depth), frameSize, maxDiff)
+    return getAllObject(depth.tolist(), frameSize, maxDiff)
+
+
+def findObjectsNumba(depth, maxDiff):
+    depth = np.asarray(depth)
+    # work on a copy that can be zeroed, raw depth keeps its own type (2 bytes a pixel for z16)
+    if np.issubdtype(depth.dtype, np.integer):
+        gameState = depth.copy()
+    else:
+        gameState = depth.astype(np.float64)
+    bounds = np.empty((depth.shape[1] + 1, 4), dtype=np.int64)
+    count = compiled["findObjects"](gameState, float(maxDiff), SEARCH_ROWS, SEARCH_COLS, bounds)
+
+    objectList = []
+    for smallRow, bigRow, smallCol, bigCol in bounds[:count].tolist():
+        currentObject = FoundObject(smallRow, smallCol)
+        currentObject.bigRow, currentObject.bigCol = bigRow, bigCol
+        objectList.append(currentObject)
+    return objectList
+
+
+#Sort key for each point: its depth in the top 32 bits (the float bits flipped so they sort like the
+#floats do, negative ones too) and its index in the bottom 32, so sorting the keys sorts by depth
+#and then by index. One plain sort of these is as fast as the original argsort and needs no stable sort
+def depthOrderKeys(depth):
+    bits = np.ascontiguousarray(depth, dtype=np.float32).view(np.uint32)
+    keys = np.where(bits & 0x80000000, ~bits, bits | 0x80000000).astype(np.uint64) << 32
+    keys |= np.arange(len(bits), dtype=np.uint64)
+    return keys
+
+
+def splatPointsNumpy(out, rows, cols, depth, colors):
+    height, width = out.shape[:2]
+    inside = (rows < height) & (cols < width)
+    if not inside.all():
+        rows, cols, depth, colors = rows[inside], cols[inside], depth[inside], colors[inside]
+    keys = depthOrderKeys(depth)
+    keys.sort()
+    # back to front, and among equal depths the first point last so it is the one that stays
+    order = (keys[::-1] & 0xFFFFFFFF).astype(np.intp)
+    out[rows[order], cols[order]] = colors[order]
+
+
+def splatPointsNumba(out, rows, cols, depth, colors):
+    compiled["splat"](out, rows, cols, np.ascontiguousarray(depth, dtype=np.float32), colors)
+
+
+compiled = {}
+if numba is not None:
+    jit = numba.njit(cache=True, nogil=True)
+    isBetweenKernel = jit(isBetweenKernel)
+    binarySearchKernel = jit(binarySearchKernel)
+    insertKernel = jit(insertKernel)
+    growKernel = jit(growKernel)
+    compiled["findObjects"] = jit(findObjectsKernel)
+    compiled["splat"] = jit(splatKernel)
+
+
+backends = {
+    "numpy": (findObjectsNumpy, splatPointsNumpy),
+    "numba": (findObjectsNumba, splatPointsNumba),
+}
+backend = None
+
+
+def setBackend(name):
+    global backend
+    if name not in backends:
+        raise ValueError("Unknown kernel backend " + repr(name) + ", expected one of " + ", ".join(sorted(backends)))
+    if name == "numba" and numba is None:
+        name = "numpy"
+    backend = name
+
+
+setBackend(os.environ.get("DEPTHSENSE_KERNELS", "numba"))
+
+
+#Same objects as getAllObject, for a 2D depth array (meters, or raw units with maxDiff in raw units too)
+def findObjects(depth, maxDiff):
+    return backends[backend][0](depth, maxDiff)
+
+
+#Writes colors[k] to out[rows[k], cols[k]] for the nearest point (smallest depth) on each pixel
+#Points outside of out are skipped
+def splatPoints(out, rows, cols, depth, colors):
+    return backends[backend][1](out, rows, cols, depth, colors)
+
+
+#Compiles the kernels for the depth types detection is run on (raw uint16 and meters as float64),
+#or loads them from the cache. Does nothing on the numpy backend
+def warmUp():
+    if backend != "numba":
+        return
+    depth = np.zeros((4, 4), dtype=np.uint16)
+    findObjects(depth, 1)
+    findObjects(depth * 0.001, 0.001)
+    out = np.zeros((2, 2, 3), dtype=np.uint8)
+    index = np.zeros(1, dtype=np.uint32)
+    splatPoints(out, index, index, np.zeros(1, dtype=np.float32), np.zeros((1, 3), dtype=np.uint8))
+
+
+#----------------------------------------------------------------------------------
+
+
+def randomScene(rng, height, width):
+    depth = np.full((height, width), 3000, dtype=np.uint16)
+    for _ in range(6):
+        top, left = rng.integers(0, height), rng.integers(0, width)
+        depth[top:top + rng.integers(5, height), left:left + rng.integers(3, width // 3)] = rng.integers(500, 2500)
+    depth += rng.integers(0, 80, depth.shape, dtype=np.uint16)
+    depth[rng.random(depth.shape) < 0.05] = 0
+    return depth
+
+
+#The painter from the original pointcloud(), as a reference for splatPoints (ties go to any point)
+def painterReference(out, rows, cols, depth, colors):
+    order = depth.argsort()[::-1]
+    out[rows[order], cols[order]] = colors[order]
+
+
+def benchmarkKernels(repeat=5):
+    rng = np.random.default_rng(1)
+    names = [name for name in ("numpy", "numba") if name == "numpy" or numba is not None]
+
+    def timeIt(function):
+        function()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        return (time.perf_counter() - start) / repeat * 1000
+
+    for height, width in ((120, 160), (480, 640)):
+        depth = randomScene(rng, height, width)
+        count = height * width
+        rows = rng.integers(0, height, count).astype(np.uint32)
+        cols = rng.integers(0, width, count).astype(np.uint32)
+        pointDepth = rng.random(count).astype(np.float32)
+        colors = rng.integers(0, 256, (count, 3), dtype=np.uint8)
+        out = np.zeros((height, width, 3), dtype=np.uint8)
+        for name in names:
+            findFunction, splatFunction = backends[name]
+            findTime = timeIt(lambda: findFunction(depth, 150))
+            splatTime = timeIt(lambda: splatFunction(out, rows, cols, pointDepth, colors))
+            print("%dx%d %-5s findObjects %8.2fms  splatPoints %6.2fms" % (width, height, name, findTime, splatTime))
+        painterTime = timeIt(lambda: painterReference(out, rows, cols, pointDepth, colors))
+        print("%dx%d original painter                  %6.2fms" % (width, height, painterTime))
+
+
+if __name__ == "__main__":
+    benchmarkKernels()
@@ -0,0 +1,177 @@
+"""
+Adaptive scheduling of obstacle detection
+
+Detection is far slower than rendering a frame, so the viewer cannot run it on
+every frame. Instead of a fixed cadence, DetectionScheduler measures how long
+detection takes and how much of each frame is left over, then picks:
+
+    every   how many frames to wait between detections
+    step    extra decimation applied to the depth image before detection
+    roi     fraction of the rows (a band around the middle) that detection looks at
+
+so that guidance is refreshed within targetLatency without dropping below the
+target frame rate. A sudden change in the depth image (someone stepping in front
+of the camera, turning a corner) triggers a detection straight away.
+
+Usage:
+------
+    scheduler = DetectionScheduler()
+    if scheduler.shouldDetect(depth_image):
+        start = time.time()
+        detectImage = scheduler.crop(depth_image)
+        ...run detection on detectImage...
+        scheduler.detectionDone(time.time() - start)
+    scheduler.frameDone(frameSeconds, detected)
+"""
+
+import math
+import numpy as np
+
+
+#Ways to run detection, from best quality to cheapest: (pixel step, fraction of rows kept)
+operatingPoints = [(1, 1.0), (1, 0.75), (2, 1.0), (2, 0.75), (2, 0.5), (4, 0.5)]
+
+#Only every n-th pixel in each direction is compared when looking for depth changes
+CHANGE_SAMPLE_STEP = 8
+#Changes smaller than this (relative to the scene depth) never count as a spike
+MIN_SPIKE_CHANGE = 0.05
+
+
+def pixelFraction(level):
+    step, roi = operatingPoints[level]
+    return roi / (step * step)
+
+
+class DetectionScheduler(object):
+
+    def __init__(self, targetLatency=0.2, targetFps=30, spikeDeviations=4.0, smoothing=0.2):
+        self.targetLatency = targetLatency
+        self.frameBudget = 1.0 / targetFps
+        #How many standard deviations above the usual change counts as a spike
+        self.spikeDeviations = spikeDeviations
+        #Weight of the newest measurement in the running averages
+        self.smoothing = smoothing
+
+        self.level = 0
+        self.every = 1
+        #None means detection has not run yet, so the first frame is always detected
+        self.framesWaited = None
+        self.detectCost = None
+        #Time a frame takes without detection (render, ingest), not counting the wait for the camera
+        self.frameTime = None
+        self.spiked = False
+
+        self.previousSample = None
+        self.changeMean = None
+        self.changeVariance = 0.0
+
+    @property
+    def step(self):
+        return operatingPoints[self.level][0]
+
+    @property
+    def roi(self):
+        return operatingPoints[self.level][1]
+
+    @property
+    def latency(self):
+        """expected time from a frame arriving to its guidance being ready"""
+        framePeriod = max(self.frameTime or 0.0, self.frameBudget)
+        return (self.every - 1) * framePeriod + (self.detectCost or 0.0)
+
+    def smooth(self, average, value):
+        if average is None:
+            return value
+        return average + self.smoothing * (value - average)
+
+    def depthChanged(self, depth_image):
+        """compare a coarse sample of the depth image with the previous frame, True on a spike"""
+        sample = depth_image[::CHANGE_SAMPLE_STEP, ::CHANGE_SAMPLE_STEP].astype(np.float32)
+        previous, self.previousSample = self.previousSample, sample
+        if previous is None or previous.shape != sample.shape:
+            return False
+
+        # zero means no depth reading, ignore those pixels
+        valid = (sample > 0) & (previous > 0)
+        if not valid.any():
+            return False
+        change = np.abs(sample[valid] - previous[valid]).mean() / previous[valid].mean()
+
+        spike = self.changeMean is not None and change > MIN_SPIKE_CHANGE and \
+            change > self.changeMean + self.spikeDeviations * math.sqrt(self.changeVariance)
+
+        # exponentially weighted mean and variance of the change
+        if self.changeMean is None:
+            self.changeMean = change
+        else:
+            difference = change - self.changeMean
+            self.changeMean += self.smoothing * difference
+            self.changeVariance = (1 - self.smoothing) * (self.changeVariance + self.smoothing * difference**2)
+        return spike
+
+    def shouldDetect(self, depth_image):
+        """call once per frame, True if detection should run on this frame"""
+        self.spiked = self.depthChanged(depth_image)
+        if self.framesWaited is None or self.spiked:
+            return True
+        return self.framesWaited + 1 >= self.every
+
+    def crop(self, depth_image):
+        """cut the depth image down to the current operating point (all columns are kept)"""
+        rows = depth_image.shape[0]
+        keep = max(1, int(round(rows * self.roi)))
+        top = (rows - keep) // 2
+        return depth_image[top:top + keep:self.step, ::self.step]
+
+    def frameDone(self, seconds, detected):
+        """seconds is the time spent on the frame, not counting the wait for the camera"""
+        if detected:
+            return
+        self.frameTime = self.smooth(self.frameTime, seconds)
+        if self.framesWaited is not None:
+            self.framesWaited += 1
+
+    def detectionDone(self, seconds):
+        self.detectCost = self.smooth(self.detectCost, seconds)
+        self.framesWaited = 0
+        self.adapt()
+
+    def cadenceFor(self, cost):
+        """(smallest cadence the frame budget allows, largest cadence the latency target allows)"""
+        # never assume there is no time left at all, otherwise detection would stop completely
+        frameTime = self.frameTime or 0.0
+        spare = max(self.frameBudget - frameTime, 0.1 * self.frameBudget)
+        framePeriod = max(frameTime, self.frameBudget)
+        forBudget = max(1, int(math.ceil(cost / spare)))
+        forLatency = max(1, int((self.targetLatency - cost) // framePeriod) + 1)
+        return forBudget, forLatency
+
+    def adapt(self):
+        forBudget, forLatency = self.cadenceFor(self.detectCost)
+
+        if forBudget > forLatency and self.level < len(operatingPoints) - 1:
+            # cannot meet both targets, do less work per detection
+            newLevel = self.level + 1
+        elif self.level > 0:
+            # try more work per detection if it would still meet both targets with some margin
+            newLevel = self.level - 1
+            predicted = self.detectCost * pixelFraction(newLevel) / pixelFraction(self.level)
+            upBudget, upLatency = self.cadenceFor(predicted * 1.25)
+            if upBudget > upLatency:
+                newLevel = self.level
+        else:
+            newLevel = self.level
+
+        if newLevel != self.level:
+            # guess the cost at the new level until it has been measured
+            self.detectCost *= pixelFraction(newLevel) / pixelFraction(self.level)
+            self.level = newLevel
+            forBudget, forLatency = self.cadenceFor(self.detectCost)
+
+        # keeping the frame rate wins over latency, the level change above catches up next time
+        self.every = forBudget
+
+    def describe(self):
+        return "detect every %d frames, step %d, roi %d%%, %.1fms, latency %dms%s" % (
+            self.every, self.step, self.roi * 100, (self.detectCost or 0.0) * 1000,
+            self.latency * 1000, " (spike)" if self.spiked else "")
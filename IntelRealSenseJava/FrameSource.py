@@ -0,0 +1,146 @@
+"""
+Depth frame sources for offline analysis
+
+Each source is a generator that yields one tuple per depth frame:
+
+    (frameIndex, timestamp, depth_image, depth_scale)
+
+where timestamp is in milliseconds, depth_image is a 2D uint16 array of raw
+depth units and depth_scale turns those units into meters. The frames have
+already been decimated the same way the live viewer does it, so the analysis
+sees the same resolution it would see on the camera.
+
+Supported recordings:
+    .bag    RealSense SDK recordings (needs pyrealsense2)
+    .npz    depth stacks saved with numpy: "depth" (frames x rows x cols, uint16),
+            optional "depth_scale" (defaults to 0.001) and "timestamps" (ms)
+            Kinect recordings store "raw_depth" (11 bit values) instead of "depth",
+            they are converted to millimetres by KinectDepth.kinectFrames
+            Stacks saved with np.savez are read one frame at a time, ones saved
+            with np.savez_compressed have to be loaded whole
+"""
+
+import os
+import struct
+import zipfile
+import numpy as np
+
+from KinectDepth import kinectFrames
+
+
+#Default depth unit of the D400 cameras (1 millimetre)
+DEFAULT_DEPTH_SCALE = 0.001
+
+
+#This reads a .bag recording as fast as we can process it (not in real time)
+def bagFrames(path, decimateLevel):
+    import pyrealsense2 as rs
+
+    config = rs.config()
+    rs.config.enable_device_from_file(config, path, repeat_playback=False)
+    config.enable_stream(rs.stream.depth)
+
+    pipeline = rs.pipeline()
+    profile = pipeline.start(config)
+    device = profile.get_device()
+    device.as_playback().set_real_time(False)
+    depth_scale = device.first_depth_sensor().get_depth_scale()
+
+    decimate = rs.decimation_filter()
+    decimate.set_option(rs.option.filter_magnitude, 2 ** decimateLevel)
+
+    frameIndex = 0
+    try:
+        while True:
+            success, frames = pipeline.try_wait_for_frames(1000)
+            if not success:
+                #Playback reached the end of the file
+                break
+            depth_frame = frames.get_depth_frame()
+            if not depth_frame:
+                continue
+            depth_frame = decimate.process(depth_frame)
+            #Copy so the image stays valid after the SDK recycles the frame
+            depth_image = np.array(depth_frame.get_data(), dtype=np.uint16)
+            yield frameIndex, depth_frame.get_timestamp(), depth_image, depth_scale
+            frameIndex += 1
+    finally:
+        pipeline.stop()
+
+
+#Where the frames of a (frames x rows x cols) array in an .npz start: (offset in the file, shape, dtype)
+#None if they can't be read straight from the file (compressed, Fortran order or not a 3D stack)
+def npzStackLayout(path, key):
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(key + ".npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+        with archive.open(info) as member:
+            version = np.lib.format.read_magic(member)
+            if version == (1, 0):
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(member)
+            elif version == (2, 0):
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(member)
+            else:
+                return None
+            headerLength = member.tell()
+    if fortranOrder or dtype.hasobject or len(shape) != 3:
+        return None
+
+    # the member's data starts after its local file header, whose name and extra field lengths are in the header itself
+    with open(path, "rb") as stackFile:
+        stackFile.seek(info.header_offset)
+        localHeader = struct.unpack("<4s5H3L2H", stackFile.read(30))
+    return info.header_offset + 30 + localHeader[9] + localHeader[10] + headerLength, shape, dtype
+
+
+#This yields the frames of one array of an .npz recording one at a time, so only the current
+#frame is in memory no matter how long the recording is
+def npzStackFrames(path, key):
+    layout = npzStackLayout(path, key)
+    if layout is None:
+        #Compressed arrays can only be read whole
+        with np.load(path) as data:
+            stack = data[key]
+        yield from stack
+        return
+
+    offset, shape, dtype = layout
+    frameValues = shape[1] * shape[2]
+    with open(path, "rb") as stackFile:
+        stackFile.seek(offset)
+        for _ in range(shape[0]):
+            yield np.fromfile(stackFile, dtype=dtype, count=frameValues).reshape(shape[1:])
+
+
+#This reads a numpy depth stack, decimating by keeping every n-th pixel
+#(the SDK filter combines each block instead, so values can differ slightly)
+def npzFrames(path, decimateLevel):
+    with np.load(path) as data:
+        isKinect = "raw_depth" in data
+        depth_scale = float(data["depth_scale"]) if "depth_scale" in data else DEFAULT_DEPTH_SCALE
+        timestamps = data["timestamps"] if "timestamps" in data else None
+
+    if isKinect:
+        yield from kinectFrames(npzStackFrames(path, "raw_depth"), timestamps, decimateLevel)
+        return
+
+    step = 2 ** decimateLevel
+    for frameIndex, depth in enumerate(npzStackFrames(path, "depth")):
+        timestamp = float(timestamps[frameIndex]) if timestamps is not None else frameIndex * 1000.0 / 30
+        depth_image = np.ascontiguousarray(depth[::step, ::step], dtype=np.uint16)
+        yield frameIndex, timestamp, depth_image, depth_scale
+
+
+frameSources = {
+    ".bag": bagFrames,
+    ".npz": npzFrames,
+}
+
+
+#This picks the right source for a recording based on its file extension
+def openRecording(path, decimateLevel):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in frameSources:
+        raise ValueError("Unsupported recording " + repr(path) + ", expected one of " + ", ".join(sorted(frameSources)))
+    return frameSources[extension](path, decimateLevel)
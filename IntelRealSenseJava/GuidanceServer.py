@@ -0,0 +1,283 @@
+"""
+Local guidance service
+
+Publishes each detection result to any number of local subscribers (the audio
+and haptic feedback processes) as soon as it is ready, instead of them having
+to read the viewer's prints. The server runs an asyncio loop in a background
+thread so the viewer's own loop never waits on a subscriber: every subscriber
+has a small queue, and when a slow one falls behind its oldest messages are
+dropped so it always gets the newest guidance.
+
+Transport is a Unix socket (or a localhost TCP port where there are no Unix
+sockets). Each message is one line of compact JSON:
+
+    {"frame":120,"t":1573247012.512,"sent":1573247012.514,"heading":0.62,
+     "direction":"left","lateral":0.31,"forward":2.45,"objects":[[0.0,0.46,0.81]]}
+
+    t        host time (time.time()) when the frame arrived from the camera
+    sent     host time when the message was handed to the subscribers
+    heading  moveDecimal from findLongestStreak (0 to 1 across the image, negative if no gap)
+    lateral  sideways offset of the gap in meters (positive is to the right), null if no gap
+    forward  distance to the far side of the gap in meters, null if no gap
+    objects  one [left, right, nearest] per object, columns as fractions of the width and depth in meters
+
+or, with binary=True, a little endian length prefixed record (see encodeBinary).
+
+Usage:
+------
+    python GuidanceServer.py            prints the messages and their latency, as a subscriber
+    python GuidanceServer.py --binary   same for a server started with binary=True
+"""
+
+import argparse
+import asyncio
+import errno
+import json
+import math
+import os
+import socket
+import stat
+import struct
+import threading
+import time
+
+
+DEFAULT_SOCKET_PATH = "/tmp/depthsense-guidance.sock"
+#Used instead of the socket path where Unix sockets are not available
+DEFAULT_PORT = 8765
+
+#frame, t, sent, heading, lateral, forward, direction (0 right, 1 left), object count
+BINARY_HEADER = struct.Struct("<IddfffBB")
+#left, right, nearest of one object
+BINARY_OBJECT = struct.Struct("<fff")
+BINARY_LENGTH = struct.Struct("<H")
+
+
+#This turns a detection result into the message the subscribers get
+#detectImage is the depth image detection ran on, step is how many columns of the
+#decimated frame one of its columns covers, intrinsics are those of the decimated frame
+def guidanceMessage(frame, timestamp, objectList, moveDecimal, direction, detectImage, depth_scale, step, intrinsics):
+    width = detectImage.shape[1]
+    objects = []
+    for currentObject in objectList:
+        block = detectImage[currentObject.smallRow:currentObject.bigRow + 1, currentObject.smallCol:currentObject.bigCol + 1]
+        valid = block[block > 0]
+        nearest = float(valid.min()) * depth_scale if valid.size > 0 else None
+        objects.append([currentObject.smallCol / width, currentObject.bigCol / width, nearest])
+
+    lateral = forward = None
+    if moveDecimal >= 0:
+        gapCol = min(int(moveDecimal * width), width - 1)
+        column = detectImage[:, gapCol]
+        valid = column[column > 0]
+        if valid.size > 0:
+            forward = float(valid.mean()) * depth_scale
+            lateral = (gapCol * step - intrinsics.ppx) / intrinsics.fx * forward
+
+    return {
+        "frame": frame,
+        "t": timestamp,
+        "heading": moveDecimal,
+        "direction": direction,
+        "lateral": lateral,
+        "forward": forward,
+        "objects": objects,
+    }
+
+
+def encodeJson(message):
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+
+def encodeBinary(message):
+    # NaN stands in for the missing values JSON sends as null
+    def orNan(value):
+        return float("nan") if value is None else value
+
+    objects = message["objects"][:255]
+    body = BINARY_HEADER.pack(message["frame"] & 0xFFFFFFFF, message["t"], message["sent"], message["heading"],
+                              orNan(message["lateral"]), orNan(message["forward"]),
+                              1 if message["direction"] == "left" else 0, len(objects))
+    body += b"".join(BINARY_OBJECT.pack(left, right, orNan(nearest)) for left, right, nearest in objects)
+    return BINARY_LENGTH.pack(len(body)) + body
+
+
+def decodeBinary(body):
+    def orNone(value):
+        return None if math.isnan(value) else value
+
+    frame, t, sent, heading, lateral, forward, direction, count = BINARY_HEADER.unpack_from(body)
+    objects = []
+    for index in range(count):
+        left, right, nearest = BINARY_OBJECT.unpack_from(body, BINARY_HEADER.size + index * BINARY_OBJECT.size)
+        objects.append([left, right, orNone(nearest)])
+    return {
+        "frame": frame,
+        "t": t,
+        "sent": sent,
+        "heading": heading,
+        "direction": "left" if direction else "right",
+        "lateral": orNone(lateral),
+        "forward": orNone(forward),
+        "objects": objects,
+    }
+
+
+class GuidanceServer(object):
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, port=DEFAULT_PORT, binary=False, queueSize=4):
+        self.path = path if hasattr(socket, "AF_UNIX") else None
+        self.port = port
+        self.encode = encodeBinary if binary else encodeJson
+        self.queueSize = queueSize
+        self.subscribers = set()
+        self.tasks = set()
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+        self.thread = None
+        #Set when the server could not start listening, start() raises it
+        self.error = None
+        #Messages dropped because a subscriber could not keep up
+        self.dropped = 0
+        #Running average of the time from the frame arriving to the message being written out
+        self.latency = None
+
+    def start(self):
+        """start serving in the background, raises the error if the server can't listen"""
+        self.thread = threading.Thread(target=self.run, name="GuidanceServer", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+        return self
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.listen())
+        except Exception as error:
+            self.error = error
+        finally:
+            if self.error is None:
+                self.loop = loop
+            # start() waits for this whether or not listening worked
+            self.ready.set()
+        if self.error is not None:
+            loop.close()
+            return
+        loop.run_forever()
+
+    async def listen(self):
+        if self.path is not None:
+            if os.path.exists(self.path):
+                self.removeStaleSocket()
+            self.server = await asyncio.start_unix_server(self.handleSubscriber, path=self.path)
+        else:
+            self.server = await asyncio.start_server(self.handleSubscriber, host="127.0.0.1", port=self.port)
+
+    def removeStaleSocket(self):
+        """delete the socket file left by a server that is gone, but never take one that is still listening"""
+        if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+            raise OSError(errno.EEXIST, "Not a socket, refusing to replace", self.path)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except ConnectionRefusedError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, "Another guidance server is already listening on", self.path)
+
+    async def shutdown(self):
+        self.server.close()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def publish(self, message):
+        """hand a message to every subscriber, safe to call from the viewer's thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.fanOut, message)
+
+    def fanOut(self, message):
+        message["sent"] = time.time()
+        # encode once, every subscriber gets the same bytes
+        data = self.encode(message)
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait((message["t"], data))
+
+    async def handleSubscriber(self, reader, writer):
+        queue = asyncio.Queue(maxsize=self.queueSize)
+        self.subscribers.add(queue)
+        self.tasks.add(asyncio.current_task())
+        try:
+            while True:
+                timestamp, data = await queue.get()
+                writer.write(data)
+                await writer.drain()
+                latency = time.time() - timestamp
+                self.latency = latency if self.latency is None else self.latency + 0.1 * (latency - self.latency)
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            # the subscriber went away, or the server is shutting down
+            pass
+        finally:
+            self.subscribers.discard(queue)
+            self.tasks.discard(asyncio.current_task())
+            writer.close()
+
+    def describe(self):
+        return "%d subscribers, latency %s, %d dropped" % (
+            len(self.subscribers), "-" if self.latency is None else "%.1fms" % (self.latency * 1000), self.dropped)
+
+
+#A subscriber that prints every message with how long it took to arrive
+async def listen(path, port, binary):
+    if path is not None and hasattr(socket, "AF_UNIX"):
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    while True:
+        if binary:
+            length, = BINARY_LENGTH.unpack(await reader.readexactly(BINARY_LENGTH.size))
+            message = decodeBinary(await reader.readexactly(length))
+        else:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+        print("%.2fms %r" % ((time.time() - message["t"]) * 1000, message))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the guidance messages published by the viewer.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket of the server")
+    parser.add_argument("--port", type=int, default=None, help="connect to this localhost port instead of the socket")
+    parser.add_argument("--binary", action="store_true", help="the server sends binary records instead of JSON")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(listen(None if args.port is not None else args.socket, args.port or DEFAULT_PORT, args.binary))
+    except (KeyboardInterrupt, asyncio.IncompleteReadError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
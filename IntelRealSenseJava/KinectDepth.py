@@ -0,0 +1,120 @@
+"""
+Kinect depth conversion
+
+Python version of the raw depth handling in the Processing sketches
+(rawDepthToMeters, depthLookUp, depthToWorld and createDepthArray in
+sketch_20191108_INTELKinectV7New). Instead of converting one pixel at a time,
+a whole frame is converted at once: the 2048 entry lookup table is applied with
+numpy indexing, and deprojection multiplies by per-pixel ray tables that are
+only computed once per frame size.
+
+kinectFrames turns Kinect recordings into the same uint16 millimetre frames the
+RealSense sources produce, so the rest of the analysis does not care which
+camera recorded them.
+
+Usage:
+------
+    python KinectDepth.py       times the conversion of a full 640x480 frame
+
+The results are checked against the sketch's per pixel formulas in test_KinectDepth.py.
+"""
+
+import functools
+import time
+import numpy as np
+
+
+KINECT_WIDTH = 640
+KINECT_HEIGHT = 480
+#Raw value the Kinect reports when it has no depth reading
+NO_READING = 2047
+
+# These constants come from: http://graphics.stanford.edu/~mdfisher/Kinect.html
+FX_D = 1.0 / 5.9421434211923247e+02
+FY_D = 1.0 / 5.9104053696870778e+02
+CX_D = 3.3930780975300314e+02
+CY_D = 2.4273913761751615e+02
+
+
+#Same values as rawDepthToMeters in the sketch, for every possible raw value (0 - 2047)
+def rawDepthToMeters(depthValue):
+    depthValue = np.asarray(depthValue, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        meters = 1.0 / (depthValue * -0.0030711016 + 3.3309495161)
+    return np.where(depthValue < NO_READING, meters, 0.0).astype(np.float32)
+
+
+depthLookUp = rawDepthToMeters(np.arange(NO_READING + 1))
+
+#The same table in whole millimetres, for the uint16 frames the analysis uses
+#Raw values past about 1083 give negative or huge distances, those become 0 (no reading)
+depthLookUpMillimetres = np.where((depthLookUp > 0) & (depthLookUp * 1000 <= np.iinfo(np.uint16).max),
+                                  np.round(depthLookUp * 1000), 0).astype(np.uint16)
+
+
+#Per-pixel (x - cx) * fx and (y - cy) * fy, so deprojecting is just two multiplies
+#step is the decimation of the frame, pixel (row, col) of it is pixel (row*step, col*step) of the camera
+@functools.lru_cache(maxsize=8)
+def rayTables(height, width, step=1):
+    xRay = ((np.arange(width, dtype=np.float64) * step - CX_D) * FX_D).astype(np.float32)
+    yRay = ((np.arange(height, dtype=np.float64) * step - CY_D) * FY_D).astype(np.float32)
+    return xRay[np.newaxis, :], yRay[:, np.newaxis]
+
+
+def safeRaw(rawDepth):
+    # values above 2047 would index past the table, the Kinect never sends them but recordings might
+    rawDepth = np.asarray(rawDepth)
+    if rawDepth.size > 0 and rawDepth.max() > NO_READING:
+        rawDepth = np.minimum(rawDepth, NO_READING)
+    return rawDepth
+
+
+#Whole frame version of createDepthArray in the sketch: a 2D array of meters
+def createDepthArray(rawDepth):
+    return depthLookUp[safeRaw(rawDepth)]
+
+
+#Whole frame version of depthToWorld in the sketch: one xyz row per pixel, like the viewer's verts
+def depthToWorld(rawDepth, step=1):
+    depth = createDepthArray(rawDepth)
+    xRay, yRay = rayTables(depth.shape[0], depth.shape[1], step)
+    verts = np.empty(depth.shape + (3,), dtype=np.float32)
+    np.multiply(xRay, depth, out=verts[:, :, 0])
+    np.multiply(yRay, depth, out=verts[:, :, 1])
+    verts[:, :, 2] = depth
+    return verts.reshape(-1, 3)
+
+
+def rawDepthToMillimetres(rawDepth):
+    return depthLookUpMillimetres[safeRaw(rawDepth)]
+
+
+#Frame source for Kinect recordings: rawFrames are the 480 x 640 frames of 11 bit values (the "raw_depth"
+#of a recording saved with numpy) and timestamps their times in ms, or None for 30 FPS.
+#Yields the same tuples as the sources in FrameSource
+def kinectFrames(rawFrames, timestamps, decimateLevel):
+    step = 2 ** decimateLevel
+    for frameIndex, rawDepth in enumerate(rawFrames):
+        timestamp = float(timestamps[frameIndex]) if timestamps is not None else frameIndex * 1000.0 / 30
+        depth_image = rawDepthToMillimetres(rawDepth[::step, ::step])
+        yield frameIndex, timestamp, depth_image, 0.001
+
+
+def benchmarkKinect(repeat=50):
+    rawDepth = np.random.default_rng(0).integers(400, 1000, (KINECT_HEIGHT, KINECT_WIDTH), dtype=np.uint16)
+    rawDepth[::7, ::5] = NO_READING
+
+    def timeIt(function):
+        function(rawDepth)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function(rawDepth)
+        return (time.perf_counter() - start) / repeat * 1000
+
+    print("createDepthArray      %.2fms" % timeIt(createDepthArray))
+    print("rawDepthToMillimetres %.2fms" % timeIt(rawDepthToMillimetres))
+    print("depthToWorld          %.2fms" % timeIt(depthToWorld))
+
+
+if __name__ == "__main__":
+    benchmarkKinect()
@@ -20,6 +20,7 @@ Keyboard:
     [d]     Cycle through decimation values
     [z]     Toggle point scaling
     [c]     Toggle color source
+    [m]     Toggle compact mode (detection runs on the raw integer depth)
     [s]     Save PNG (./out.png)
     [e]     Export points to ply (./out.ply)
     [q\ESC] Quit
@@ -30,6 +31,10 @@ import time
 import cv2
 import numpy as np
 import pyrealsense2 as rs
+from DepthAnalysis import findLongestStreak, translateToWords
+from DepthKernels import findObjects, splatPoints, warmUp
+from DetectionScheduler import DetectionScheduler
+from GuidanceServer import GuidanceServer, guidanceMessage
 
 class AppState:
 
@@ -46,6 +51,8 @@ class AppState:
         self.decimate = 2
         self.scale = True
         self.color = True
+        #Runs detection on the raw integer depth instead of meters, for low memory boards
+        self.compact = False
 
     def reset(self):
         self.pitch, self.yaw, self.distance = 0, 0, 2
@@ -80,6 +87,8 @@ profile = pipeline.get_active_profile()
 depth_profile = rs.video_stream_profile(profile.get_stream(rs.stream.depth))
 depth_intrinsics = depth_profile.get_intrinsics()
 w, h = depth_intrinsics.width, depth_intrinsics.height
+#Multiplying a raw z16 value by this gives the distance in meters
+depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
 
 
 
@@ -236,16 +245,10 @@ def frustum(out, intrinsics, color=(0x40, 0x40, 0x40)):
 
 def pointcloud(out, verts, texcoords, color, painter=True):
     """draw point cloud with optional painter's algorithm"""
-    if painter:
-        # Painter's algo, sort points from back to front
-
-        # get reverse sorted indices by z (in view-space)
-        # https://gist.github.com/stevenvo/e3dad127598842459b68
-        v = view(verts)
-        s = v[:, 2].argsort()[::-1]
-        proj = project(v[s])
-    else:
-        proj = project(view(verts))
+    v = view(verts)
+    proj = project(v)
+    # view-space depth, the painter keeps the nearest point on each pixel
+    z = v[:, 2]
 
     if state.scale:
         proj *= 0.5**state.decimate
@@ -262,360 +265,55 @@ def pointcloud(out, verts, texcoords, color, painter=True):
 #    m = True
 
     cw, ch = color.shape[:2][::-1]
-    if painter:
-        # sort texcoord with same indices as above
-        # texcoords are [0..1] and relative to top-left pixel corner,
-        # multiply by size and add 0.5 to center
-        v, u = (texcoords[s] * (cw, ch) + 0.5).astype(np.uint32).T
-    else:
-        v, u = (texcoords * (cw, ch) + 0.5).astype(np.uint32).T
+    # texcoords are [0..1] and relative to top-left pixel corner,
+    # multiply by size and add 0.5 to center
+    v, u = (texcoords * (cw, ch) + 0.5).astype(np.uint32).T
     # clip texcoords to image
     np.clip(u, 0, ch-1, out=u)
     np.clip(v, 0, cw-1, out=v)
 
     # perform uv-mapping
-    out[i[m], j[m]] = color[u[m], v[m]]
-
-#================================================================================================================================================================
-
-
-
-
-
-
-
-
-
-class FoundObject(object):
-    def __init__(self, row, col):
-        self.bigRow = row
-        self.bigCol = col
-        self.smallRow = row
-        self.smallCol = col
-    #This adds a point to the found object
-    def addPoint(self, newRow, newCol):
-        if self.bigRow < newRow:
-            self.bigRow = newRow
-        elif self.smallRow > newRow:
-            self.smallRow = newRow
-        if self.bigCol < newCol:
-            self.bigCol = newCol
-        elif self.smallCol > newCol:
-            self.smallCol = newCol
-    #THis determines if a column is between, on the left, or on the right of an object
-    def isBetween(self, newCol):
-        if newCol > self.smallCol:
-            if newCol < self.bigCol:
-                return True
-            else:
-                return "right"
-        else:
-            return "left"
-    def __repr__(self):
-        return "Row between " + repr(self.smallRow) + " and " + repr(self.bigRow) + ", col between " + repr(self.smallCol) + ", " + repr(self.bigCol)
-            
-#You dont have to search top-left directions
-searchingPattern = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
-
-'''
-def getAllObject(gameState, depth_intrinsics, maxDiff):
-    objectList = []
-#    for row in range(depth_intrinsics.height):
-#        for col in range(depth_intrinsics.row):
-    for row in range(depth_intrinsics[0]):
-        for col in range(depth_intrinsics[1]):
-            if gameState[row][col] != 0:
-                currentObject = FoundObject(row, col)
-                gameState, currentObject = getAllSurrounding(gameState, currentObject, row, col, maxDiff, searchingPattern, depth_intrinsics)
-                objectList += [currentObject]
-    return objectList
-'''
-
-#This method returns the object's biggest col num if the targetcol is found to be within an object, else it returns -1
-def binarySearchObject(objectList, targetCol):
-    if len(objectList) == 0:
-        return -1
-    left = 0
-    right = len(objectList)-1
-    mid = (left+right)//2
-#    print("left = " + repr(left))
-#    print("right = " + repr(right))
-#    print("mid = " + repr(mid))
-#    print("objectList = " + repr(objectList))
-#    print("targetCol = " + repr(targetCol))
-    while right - left > 1:
-#        print("left = " + repr(left))
-#        print("right = " + repr(right))
-#        print("mid = " + repr(mid))
-        '''
-        currentCol = objectList[mid].smallCol
-        if currentCol == targetCol:
-            return objectList[mid].bigCol
-        elif currentCol < targetCol:
-            left = mid
-            mid = (left+right)//2
-        elif currentCol > targetCol:
-            right = mid
-            mid = (left+right)//2
-        else:
-            print("ERRRORRRRRR")
-        '''
-        compare = objectList[mid].isBetween(targetCol)
-        if compare == True:
-            return objectList[mid].bigCol
-        elif compare == "left":
-            right = mid
-            mid = (left+right)//2
-        elif compare == "right":
-            left = mid
-            mid = (left+right)//2
-        else:
-            print("ERRRORRRRR")
-    '''
-    if objectList[left].smallCol == targetCol:
-        print("lies within object of " + repr(objectList[left]))
-        return objectList[left].bigCol
-    elif objectList[right].smallCol == targetCol:
-        print("lies within object of " + repr(objectList[right]))
-        return objectList[right].bigCol
-    '''
-    if objectList[left].isBetween(targetCol) == True:
-#        print("object = " + repr(objectList[left]))
-#        print("targetCol = " + repr(targetCol))
-#        print("isBetween = " + repr(objectList[left].isBetween(targetCol)))
-#        print("lies within object of " + repr(objectList[left]))
-        return objectList[left].bigCol
-    elif objectList[right].isBetween(targetCol) == True:
-#        print("lies within object of " + repr(objectList[right]))
-        return objectList[right].bigCol
-    return -1
-
-#This method inserts another object into an objectList in order (binary search and insert)
-def binaryInsertObject(objectList, currentObject):
-    if len(objectList) == 0:
-        objectList += [currentObject]
-        return objectList
-    left = 0
-    right = len(objectList) - 1
-    mid = (left + right) // 2
-    while left - right > 1:
-        
-        if left == right:
-            if objectList[left].smallCol > currentObject.smallCol:
-                objectList.insert(left, currentObject)
-            else:
-                objectList.insert(left+1, currentObject)
-        if left > right:
-            objectList.insert(left, currentObject)
-        
-        currentCol = objectList[mid].smallCol
-        if currentCol < currentObject.smallCol:
-            left = mid + 1
-            mid = (left + right) // 2
-        elif currentCol > currentObject.smallCol:
-            right = mid - 1
-            mid = (left + right) // 2
-        else:
-            print("INSERT ERRORRR")
-            
-    if objectList[left].smallCol < currentObject.smallCol:
-        if objectList[right].smallCol < currentObject.smallCol:
-            objectList.insert(right + 1, currentObject)
-        else:
-            objectList.insert(right, currentObject)
-    else:
-        objectList.insert(left, currentObject)
-    '''
-    if objectList[left].smallCol > currentObject.smallCol:
-        objectList.insert(left, currentObject)
-    elif objectList[left].smallCol < currentObject.smallCol:
-        objectList.insert(left + 1, currentObject)
-    '''
-    return objectList
-
-
-#This method sets every point within the smallCol to bigCol to become zero
-def setColRangeToZero(gameState, smallCol, bigCol):
-    length = len(gameState)
-    for row in range(length):
-        for col in range(smallCol, bigCol + 1):
-            gameState[row][col] = 0;
-    return gameState
-
-#This method gets all the objects in a given game state
-def getAllObject(gameState, depth_intrinsics, maxDiff):
-    objectList = []
-#    for row in range(depth_intrinsics.height):
-#        for col in range(depth_intrinsics.row):
-    row = 0
-    col = 0
-    while row < depth_intrinsics.height:
-        while col < depth_intrinsics.width:
-#            print("----------------------------------------------------------------")
-#            print("We are checking row: " + repr(row) + " and col: " + repr(col))
-            if gameState[row][col] != 0:
-#                print("Point value is " + repr(gameState[row][col]))
-                currentObject = FoundObject(row, col)
-#                print("gameState before is \n" + repr(gameState))
-                gameState, currentObject = getAllSurrounding(gameState, currentObject, row, col, maxDiff, searchingPattern, depth_intrinsics, 0)
-                #In case there is a glitch in the detection, where there is only one point 
-#                print("gameState after is \n" + repr(gameState))
-#                print("currentObject Found is " + repr(currentObject))
-                col += 1
-                if currentObject.bigCol - currentObject.smallCol >=2:
-#                    print("objectList before is " + repr(objectList))
-                    objectList = binaryInsertObject(objectList, currentObject)
-#                    print("objectList after is " + repr(objectList))
-                    #This sets everything within these columns to become zero
-#                    print("gameState changed from \n" + repr(gameState))
-                    gameState = setColRangeToZero(gameState, currentObject.smallCol, currentObject.bigCol)
-#                    print("to \n" + repr(gameState))
-#                else:
-#                    print("object ignored because its too small")
-            else:
-#                print("point has a value of zero")
-                tempCol = binarySearchObject(objectList, col)
-                
-                if tempCol == -1:
- #                   print("lies in no object")
-                    col += 1
-                    continue
-                else:
-#                    print("cols jumpting from " + repr(col) + " to " + repr(tempCol))
-                    col = tempCol
-                    col += 1
-#        print("NEXT ROW ===============================================================")
-        col = 0
-        row += 1
-    return objectList
-
-
-#This gets all the surrounding pixels that have a close depth value to the target pixel
-#Uses recursion, and it always deletes the currentRow and currentCol, dosn't delete the next ones
-def getAllSurrounding(gameState, currentObject, currentRow, currentCol, maxDiff, searchingPattern, depth_intrinsics, count):
-    if count > 80:
-        return
-    currentValue = gameState[currentRow][currentCol]
-    gameState[currentRow][currentCol] = 0
-#    print("BASEEEE = " + repr(currentRow) + ", " + repr(currentCol))
-    for currentDirection in searchingPattern:
-        addRow, addCol = currentDirection
-        newRow = currentRow + addRow
-        newCol = currentCol + addCol
-#        print("now searching + " + repr(newRow) + " and " + repr(newCol))
-#        if newCol < 0 or newCol >= depth_intrinsics.width or newRow < 0 or newRow >= depth_intrinsics.height:
-        if newCol < 0 or newCol >= depth_intrinsics.width or newRow < 0 or newRow >= depth_intrinsics.height:
-#            print("skipped because out of bounds on row of " + repr(newRow) + ", and col of " + repr(newCol))
-            continue
-        newValue = gameState[newRow][newCol]
-        if newValue == 0:
-            
-            continue
-        
-        if abs(newValue - currentValue) <= maxDiff:
-#            print("MATCH")
-            currentObject.addPoint(newRow, newCol)
-            getAllSurrounding(gameState, currentObject, newRow, newCol, maxDiff, searchingPattern, depth_intrinsics, count+1)
-    return gameState, currentObject
-
-def testGetAllSurrounding():
-    '''
-    gameState = [[0, 0, 0, 0, 4, 6, 5, 6, 8, 14, 13, 0, 0], 
-                 [0, 0, 0, 3, 3, 5, 3, 3, 5, 11, 16, 10, 0], 
-                 [0, 0, 0, 0, 2, 4, 5, 5, 4, 13, 14, 13, 0],
-                 [0, 0, 0, 5, 4, 3, 5, 2, 4, 14, 13, 15, 0]]
-#    currentObject = FoundObject(0, 4)
-    maxDiff = 2
-    depth_intrinsics = (4, 13)
-#    print("GameState before = \n" + repr(gameState))
-#    getAllSurrounding(gameState, currentObject, 0, 4, maxDiff, searchingPattern, depth_intrinsics)
-#    print("GameState after = \n" + repr(gameState))
-#    print(currentObject)
-    print(gameState)
-    objectList = getAllObject(gameState, depth_intrinsics, maxDiff)
-    print(gameState)
-    print(objectList)
-    
-    
-    
-    gameState = [[2, 0, 4, 0, 6, 0, 8, 0, 10], 
-                 [0, 12, 0, 14, 0, 16, 0, 18, 0], 
-                 [20, 0, 22, 0, 24, 0, 26, 0, 28],
-                 [0, 30, 0, 32, 0, 34, 0, 36, 0]]
-#    currentObject = FoundObject(0, 4)
-    maxDiff = 2
-    depth_intrinsics = (4, 9)
-#    print("GameState before = \n" + repr(gameState))
-#    getAllSurrounding(gameState, currentObject, 0, 4, maxDiff, searchingPattern, depth_intrinsics)
-#    print("GameState after = \n" + repr(gameState))
-#    print(currentObject)
-    print(gameState)
-    objectList = getAllObject(gameState, depth_intrinsics, maxDiff)
-    print(gameState)
-    print(objectList)
-    '''
-    gameState = [[0.0, 0.0, 0.54, 0.83, 0.64, 1.1, 1.23, 1.21, 0.0, 0.0, 0.0], 
-                 [0.0, 0.0, 0.23, 0.38, 0.45, 0.98, 1.07, 1.14, 1.21, 0.0, 0.0], 
-                 [0.0, 0.32, 0.31, 0.42, 0.0, 0.0, 1.1, 1.21, 1.32, 1.23, 0.0],
-                 [0.0, 0.0, 0.35, 0.37, 0.52, 0.0, 0.0, 1.09, 1.27, 1.25, 1.22]]
-#    currentObject = FoundObject(0, 4)
-    maxDiff = 0.2
-    depth_intrinsics = (4, 11)
-#    print("GameState before = \n" + repr(gameState))
-#    getAllSurrounding(gameState, currentObject, 0, 4, maxDiff, searchingPattern, depth_intrinsics)
-#    print("GameState after = \n" + repr(gameState))
-#    print(currentObject)
-    print(gameState)
-    objectList = getAllObject(gameState, depth_intrinsics, maxDiff)
-    print(gameState)
-    print(objectList)
-    
-    
-
-#testGetAllSurrounding()
-
-
-
-#This method finds the longest streak of empty spaces and returns the degree to which someone should turn (0 to 1)
-def findLongestStreak(objectList):
-    longestStreak = -1
-    streakPosition = -1
-    totalObject = len(objectList)
-    for objectIndex in range(1, totalObject):
-        currentDif = objectList[objectIndex].smallCol - objectList[objectIndex - 1].bigCol
-        if currentDif > longestStreak:
-            longestStreak = currentDif
-            streakPosition = (objectList[objectIndex].smallCol + objectList[objectIndex - 1].bigCol)//2
-    return streakPosition / 160
-
-def translateToWords(moveDecimal):
-    if moveDecimal <= 0.5:
-        return "right"
+    if painter:
+        # Painter's algo with a z-buffer instead of sorting all points from back to front
+        splatPoints(out, i[m], j[m], z[m], color[u[m], v[m]])
     else:
-        return "left"
+        out[i[m], j[m]] = color[u[m], v[m]]
 
 
 
-#================================================================================================================================================================
-
-
 
 
 
 
 
 out = np.empty((h, w, 3), dtype=np.uint8)
+#Buffers for drawing the point cloud at depth resolution and scaling it up to out
+tmp = resized = None
 
 #For the one-time prints in the while true functions
 countVariable = 0
-#This is used as the searching pattern for getting nearby pixels (row, col)
-searchingPattern = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+#Decides which frames get obstacle detection and how much of the frame it looks at
+scheduler = DetectionScheduler()
+#Sends every detection result to the feedback processes listening on the local socket
+#If it can't listen (socket taken, no permission) the viewer still runs, just without it
+try:
+    guidance = GuidanceServer().start()
+except OSError as error:
+    print("Guidance server not started: " + repr(error))
+    guidance = None
+#Compile the detection kernels now, otherwise the first detection takes seconds and the scheduler
+#starts from that cost
+warmUp()
 
 while True:
+    #Only set when a new frame was grabbed, so paused frames don't count towards the schedule
+    frameStart = None
+    detected = False
     # Grab camera data
     if not state.paused:
         # Wait for a coherent pair of frames: depth and color
         frames = pipeline.wait_for_frames()
+        frameStart = time.time()
 
         depth_frame = frames.get_depth_frame()
         color_frame = frames.get_color_frame()
@@ -634,12 +332,9 @@ while True:
 #        depth_image = np.asanyarray(depth_frame.get_data())
 #        print(depth_image)
         
-        #This creates an array that stores all the depth information
+        #This is the raw depth information, only turned into meters when detection runs
         depthData = depth_frame.as_depth_frame()
-        depthArray = [([0] * w) for row in range(h)]
-        for width in range(w):
-            for height in range(h):
-                depthArray[height][width] = depthData.get_distance(width, height)
+        depth_image = np.asanyarray(depthData.get_data())
         
         
         #This gets the actual RGB values for pixels on the array
@@ -670,7 +365,11 @@ while True:
         
         #Testing Area
 #        countVariable += 1
-        if (countVariable % 50 == 0):
+        if scheduler.shouldDetect(depth_image):
+            detectStart = time.time()
+            #This cuts the depth information down to the part the scheduler picked
+            detectImage = scheduler.crop(depth_image)
+            detectWidth = detectImage.shape[1]
 #            print("Height = " + repr(len(depthArray)))
 #            print("Width = " + repr(len(depthArray[0])))
             
@@ -685,12 +384,25 @@ while True:
             oneTimeBool = False
             '''
             maxDiff = 1
-            objectList = getAllObject(depthArray, depth_intrinsics, maxDiff)
-            moveDecimal = findLongestStreak(objectList)
+            if state.compact:
+                #Detection runs on the raw depth units, not meters
+                objectList = findObjects(detectImage, maxDiff / depth_scale)
+            else:
+                objectList = findObjects(detectImage * depth_scale, maxDiff)
+            moveDecimal = findLongestStreak(objectList, detectWidth)
+            direction = translateToWords(moveDecimal)
+            if guidance is not None:
+                guidance.publish(guidanceMessage(countVariable, frameStart, objectList, moveDecimal, direction,
+                                                 detectImage, depth_scale, scheduler.step, depth_intrinsics))
+            scheduler.detectionDone(time.time() - detectStart)
+            detected = True
             print("====================================================")
             print("objectList = " + repr(objectList))
             print("moveDecimal = " + repr(moveDecimal))
-            print(translateToWords(moveDecimal))
+            print(direction)
+            print("operatingPoint = " + scheduler.describe())
+            if guidance is not None:
+                print("guidance = " + guidance.describe())
             
             
     countVariable += 1
@@ -728,11 +440,15 @@ while True:
     if not state.scale or out.shape[:2] == (h, w):
         pointcloud(out, verts, texcoords, color_source)
     else:
-        tmp = np.zeros((h, w, 3), dtype=np.uint8)
+        #Reuse the render buffers until the size changes instead of allocating new ones every frame
+        if tmp is None or tmp.shape[:2] != (h, w):
+            tmp = np.empty((h, w, 3), dtype=np.uint8)
+            resized = np.empty_like(out)
+        tmp.fill(0)
         pointcloud(tmp, verts, texcoords, color_source)
-        tmp = cv2.resize(
-            tmp, out.shape[:2][::-1], interpolation=cv2.INTER_NEAREST)
-        np.putmask(out, tmp > 0, tmp)
+        cv2.resize(
+            tmp, out.shape[:2][::-1], dst=resized, interpolation=cv2.INTER_NEAREST)
+        np.putmask(out, resized > 0, resized)
 
     if any(state.mouse_btns):
         axes(out, view(state.pivot), state.rotation, thickness=4)
@@ -740,12 +456,16 @@ while True:
     dt = time.time() - now
 
     cv2.setWindowTitle(
-        state.WIN_NAME, "RealSense (%dx%d) %dFPS (%.2fms) %s" %
-        (w, h, 1.0/dt, dt*1000, "PAUSED" if state.paused else ""))
+        state.WIN_NAME, "RealSense (%dx%d) %dFPS (%.2fms) %s %s" %
+        (w, h, 1.0/dt, dt*1000, scheduler.describe(),
+         ("PAUSED " if state.paused else "") + ("COMPACT" if state.compact else "")))
 
     cv2.imshow(state.WIN_NAME, out)
     key = cv2.waitKey(1)
 
+    if frameStart is not None:
+        scheduler.frameDone(time.time() - frameStart, detected)
+
     if key == ord("r"):
         state.reset()
         oneTimeBool = True
@@ -765,6 +485,10 @@ while True:
         state.scale ^= True
         oneTimeBool = True
 
+    if key == ord("m"):
+        state.compact ^= True
+        oneTimeBool = True
+
     if key == ord("c"):
         state.color ^= True
         oneTimeBool = True
@@ -782,3 +506,5 @@ while True:
 
 # Stop streaming
 pipeline.stop()
+if guidance is not None:
+    guidance.stop()
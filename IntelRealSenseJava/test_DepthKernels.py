@@ -0,0 +1,123 @@
+"""
+Checks that the numba and numpy backends of DepthKernels find the same objects and draw the same pixels
+
+Run with: python -m pytest IntelRealSenseJava
+"""
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import DepthKernels
+from DepthKernels import backends, randomScene
+
+
+def bounds(objectList):
+    return [(currentObject.smallRow, currentObject.bigRow, currentObject.smallCol, currentObject.bigCol)
+            for currentObject in objectList]
+
+
+#The example from testGetAllSurrounding in the original viewer
+SMALL_SCENE = [[0.0, 0.0, 0.54, 0.83, 0.64, 1.1, 1.23, 1.21, 0.0, 0.0, 0.0],
+               [0.0, 0.0, 0.23, 0.38, 0.45, 0.98, 1.07, 1.14, 1.21, 0.0, 0.0],
+               [0.0, 0.32, 0.31, 0.42, 0.0, 0.0, 1.1, 1.21, 1.32, 1.23, 0.0],
+               [0.0, 0.0, 0.35, 0.37, 0.52, 0.0, 0.0, 1.09, 1.27, 1.25, 1.22]]
+
+
+#A band too long for the 80 step search limit, so it is found as two objects
+def longBand():
+    depth = np.zeros((3, 200))
+    depth[:, 0:150] = 1.0
+    depth[:, 160:170] = 2.0
+    return depth
+
+
+availableBackends = ["numpy", pytest.param("numba", marks=pytest.mark.skipif(
+    DepthKernels.numba is None, reason="numba is not installed"))]
+
+
+@pytest.mark.parametrize("name", availableBackends)
+def test_small_scene(name):
+    findObjects = backends[name][0]
+    depth = np.array(SMALL_SCENE)
+    assert bounds(findObjects(depth, 0.2)) == [(0, 3, 1, 4), (0, 3, 5, 10)]
+    # the same scene in whole millimetres
+    rawDepth = np.round(depth * 1000).astype(np.uint16)
+    assert bounds(findObjects(rawDepth, 200)) == [(0, 3, 1, 4), (0, 3, 5, 10)]
+
+
+@pytest.mark.parametrize("name", availableBackends)
+def test_search_limit(name):
+    findObjects = backends[name][0]
+    assert bounds(findObjects(longBand(), 0.2)) == [(0, 2, 0, 81), (0, 2, 82, 149), (0, 2, 160, 169)]
+
+
+@pytest.mark.parametrize("name", availableBackends)
+def test_splat_keeps_nearest(name):
+    splatPoints = backends[name][1]
+    out = np.zeros((2, 2, 3), dtype=np.uint8)
+    rows = np.array([0, 0, 0, 1, 5, 1, 1], dtype=np.uint32)
+    cols = np.array([0, 0, 0, 1, 0, 0, 0], dtype=np.uint32)
+    depth = np.array([2.0, 1.0, 1.0, 3.0, 0.5, 0.5, -1.0], dtype=np.float32)
+    colors = np.array([[1, 1, 1], [2, 2, 2], [3, 3, 3], [4, 4, 4], [5, 5, 5], [6, 6, 6], [7, 7, 7]], dtype=np.uint8)
+    splatPoints(out, rows, cols, depth, colors)
+    # nearest wins, the tie goes to the first point, the point outside is skipped
+    assert out[0, 0].tolist() == [2, 2, 2]
+    assert out[1, 1].tolist() == [4, 4, 4]
+    assert out[0, 1].tolist() == [0, 0, 0]
+    # depth behind the camera still sorts below depth in front of it
+    assert out[1, 0].tolist() == [7, 7, 7]
+
+
+@pytest.mark.skipif(DepthKernels.numba is None, reason="numba is not installed")
+@pytest.mark.parametrize("trial", range(12))
+def test_backends_agree(trial):
+    rng = np.random.default_rng(trial)
+    height, width = [(120, 160), (60, 80), (240, 320)][trial % 3]
+    depth = randomScene(rng, height, width)
+    for scene, maxDiff in ((depth, 150), (depth * 0.001, 0.15)):
+        assert bounds(backends["numba"][0](scene, maxDiff)) == bounds(backends["numpy"][0](scene, maxDiff))
+
+    count = 5000
+    rows = rng.integers(0, height + 10, count).astype(np.uint32)
+    cols = rng.integers(0, width + 10, count).astype(np.uint32)
+    # rounded so there are ties to break
+    pointDepth = np.round(rng.random(count).astype(np.float32), 1)
+    colors = rng.integers(0, 256, (count, 3), dtype=np.uint8)
+    expected = np.zeros((height, width, 3), dtype=np.uint8)
+    result = np.zeros((height, width, 3), dtype=np.uint8)
+    backends["numpy"][1](expected, rows, cols, pointDepth, colors)
+    backends["numba"][1](result, rows, cols, pointDepth, colors)
+    assert (expected == result).all()
+
+
+
+#Run in a fresh interpreter, the other tests have already compiled whatever they called
+WARM_UP_CHECK = """
+import numpy as np
+import DepthKernels
+DepthKernels.setBackend("numba")
+DepthKernels.warmUp()
+signatures = [len(kernel.signatures) for kernel in DepthKernels.compiled.values()]
+# the same types the viewer and BatchAnalysis pass: a cropped z16 view, meters, and the render buffers
+depth = DepthKernels.randomScene(np.random.default_rng(0), 120, 160)
+DepthKernels.findObjects(depth[10:110:2, ::2], 150)
+DepthKernels.findObjects(depth[10:110:2, ::2] * 0.001, 0.15)
+out = np.zeros((120, 160, 3), dtype=np.uint8)
+proj = np.zeros((50, 2), dtype=np.float32)
+cols, rows = proj.astype(np.uint32).T
+inside = rows < 120
+colors = np.zeros((120, 160, 3), dtype=np.uint8)
+DepthKernels.splatPoints(out, rows[inside], cols[inside], proj[inside, 1], colors[rows[inside], cols[inside]])
+assert [len(kernel.signatures) for kernel in DepthKernels.compiled.values()] == signatures, "compiled again after warmUp"
+"""
+
+
+@pytest.mark.skipif(DepthKernels.numba is None, reason="numba is not installed")
+def test_warm_up_covers_detection_types():
+    result = subprocess.run([sys.executable, "-c", WARM_UP_CHECK], cwd=os.path.dirname(os.path.abspath(DepthKernels.__file__)),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
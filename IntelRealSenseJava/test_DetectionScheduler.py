@@ -0,0 +1,136 @@
+"""
+Drives DetectionScheduler with made up detection costs and depth images
+
+Run with: python -m pytest IntelRealSenseJava
+"""
+
+import numpy as np
+import pytest
+
+from DetectionScheduler import DetectionScheduler, operatingPoints, pixelFraction
+
+
+def flatScene(rng, depth=2000):
+    return (depth + rng.integers(0, 10, (120, 160))).astype(np.uint16)
+
+
+#Runs the first detection so the scheduler has a cost to work with
+def detectedOnce(cost, **kwargs):
+    scheduler = DetectionScheduler(**kwargs)
+    assert scheduler.shouldDetect(flatScene(np.random.default_rng(0)))
+    scheduler.detectionDone(cost)
+    return scheduler
+
+
+def test_first_frame_is_detected():
+    scheduler = DetectionScheduler()
+    assert scheduler.shouldDetect(flatScene(np.random.default_rng(0)))
+
+
+def test_conflict_moves_to_cheaper_level():
+    # 0.5s can't be spread over frames within the budget and still be ready within 0.2s
+    scheduler = detectedOnce(0.5, targetLatency=0.2, targetFps=30)
+    forBudget, forLatency = scheduler.cadenceFor(0.5)
+    assert forBudget > forLatency
+    assert scheduler.level == 1
+    # the cost is guessed for the new level until it is measured
+    assert scheduler.detectCost == pytest.approx(0.5 * pixelFraction(1) / pixelFraction(0))
+
+
+def test_keeps_getting_cheaper_while_too_slow():
+    scheduler = detectedOnce(0.5, targetLatency=0.2, targetFps=30)
+    levels = [scheduler.level]
+    for _ in range(len(operatingPoints) + 2):
+        scheduler.detectionDone(0.5)
+        levels.append(scheduler.level)
+    assert levels == sorted(levels)
+    assert levels[-1] == len(operatingPoints) - 1
+
+
+def test_margin_steps_back_to_better_quality():
+    scheduler = detectedOnce(0.001)
+    scheduler.level = 3
+    scheduler.detectionDone(0.001)
+    assert scheduler.level == 2
+    for _ in range(5):
+        scheduler.detectionDone(0.001)
+    assert scheduler.level == 0
+
+
+def test_no_step_back_without_margin():
+    scheduler = DetectionScheduler(targetLatency=0.2, targetFps=30)
+    scheduler.level = 2
+    # 0.1s meets both targets at level 2, but level 1 has three times the pixels
+    scheduler.detectCost = 0.1
+    forBudget, forLatency = scheduler.cadenceFor(0.1)
+    assert forBudget <= forLatency
+    scheduler.adapt()
+    assert scheduler.level == 2
+    assert scheduler.every == forBudget
+
+
+@pytest.mark.parametrize("cost", [0.001, 0.02, 0.05, 0.15, 0.4])
+def test_every_follows_cadence(cost):
+    scheduler = detectedOnce(cost)
+    for seconds in (0.01, 0.012, 0.009):
+        scheduler.frameDone(seconds, False)
+    scheduler.detectionDone(cost)
+    assert scheduler.every == scheduler.cadenceFor(scheduler.detectCost)[0]
+    assert scheduler.every >= 1
+
+
+def test_waits_every_frames_between_detections():
+    scheduler = detectedOnce(0.1)
+    assert scheduler.every > 1
+    rng = np.random.default_rng(1)
+    detected = []
+    for _ in range(scheduler.every):
+        detect = scheduler.shouldDetect(flatScene(rng))
+        detected.append(detect)
+        scheduler.frameDone(0.005, detect)
+    assert detected == [False] * (scheduler.every - 1) + [True]
+
+
+def test_depth_jump_detects_straight_away():
+    scheduler = detectedOnce(0.1)
+    assert scheduler.every > 1
+    rng = np.random.default_rng(2)
+    for _ in range(5):
+        scheduler.framesWaited = 0
+        assert not scheduler.shouldDetect(flatScene(rng))
+        scheduler.frameDone(0.005, False)
+
+    # something steps in front of the camera
+    scene = flatScene(rng)
+    scene[:, 40:120] = 600
+    scheduler.framesWaited = 0
+    assert scheduler.shouldDetect(scene)
+    assert scheduler.spiked
+
+
+def test_missing_depth_is_not_a_jump():
+    scheduler = detectedOnce(0.1)
+    rng = np.random.default_rng(3)
+    for _ in range(5):
+        scheduler.framesWaited = 0
+        scheduler.shouldDetect(flatScene(rng))
+    # pixels without a reading are ignored
+    scene = flatScene(rng)
+    scene[:, 40:120] = 0
+    scheduler.framesWaited = 0
+    assert not scheduler.shouldDetect(scene)
+
+
+@pytest.mark.parametrize("level", range(len(operatingPoints)))
+def test_crop_keeps_centred_band(level):
+    scheduler = DetectionScheduler()
+    scheduler.level = level
+    step, roi = operatingPoints[level]
+    image = np.arange(120 * 160).reshape(120, 160)
+    keep = int(round(120 * roi))
+    top = (120 - keep) // 2
+    cropped = scheduler.crop(image)
+    assert (cropped == image[top:top + keep:step, ::step]).all()
+    # all columns at the step, the band is in the middle
+    assert cropped.shape[1] == len(range(0, 160, step))
+    assert abs(top - (120 - top - keep)) <= 1
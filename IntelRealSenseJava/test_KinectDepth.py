@@ -0,0 +1,88 @@
+"""
+Checks the whole frame Kinect conversion against the per pixel formulas of sketch_20191108_INTELKinectV7New
+
+Run with: python -m pytest IntelRealSenseJava
+"""
+
+import numpy as np
+import pytest
+
+from FrameSource import openRecording
+from KinectDepth import (CX_D, CY_D, FX_D, FY_D, KINECT_HEIGHT, KINECT_WIDTH, NO_READING, createDepthArray,
+                         depthLookUp, depthLookUpMillimetres, depthToWorld, rawDepthToMillimetres)
+
+
+#rawDepthToMeters in the sketch
+def sketchRawDepthToMeters(depthValue):
+    if depthValue < 2047:
+        return np.float32(1.0 / (float(depthValue) * -0.0030711016 + 3.3309495161))
+    return np.float32(0.0)
+
+
+#depthToWorld in the sketch, for pixel (x, y) of the full camera frame
+def sketchDepthToWorld(x, y, depthValue):
+    depth = float(depthLookUp[depthValue])
+    return [np.float32((x - CX_D) * depth * FX_D), np.float32((y - CY_D) * depth * FY_D), np.float32(depth)]
+
+
+def rawFrame(rng, height=KINECT_HEIGHT, width=KINECT_WIDTH):
+    rawDepth = rng.integers(400, 1000, (height, width), dtype=np.uint16)
+    rawDepth[::7, ::5] = NO_READING
+    return rawDepth
+
+
+def test_lookup_matches_sketch():
+    expected = np.array([sketchRawDepthToMeters(value) for value in range(NO_READING + 1)], dtype=np.float32)
+    assert depthLookUp.dtype == np.float32
+    assert depthLookUp.shape == (NO_READING + 1,)
+    np.testing.assert_allclose(depthLookUp, expected, rtol=1e-6)
+    assert depthLookUp[NO_READING] == 0.0
+
+
+def test_millimetre_cutoff():
+    meters = depthLookUp.astype(np.float64)
+    inRange = (meters > 0) & (meters * 1000 <= 65535)
+    assert (depthLookUpMillimetres[inRange] == np.round(meters[inRange] * 1000)).all()
+    assert (depthLookUpMillimetres[~inRange] == 0).all()
+    # 1079 is the last raw value that fits in uint16 millimetres, from 1085 on the formula goes negative
+    assert depthLookUpMillimetres[1079] > 50000
+    assert (depthLookUpMillimetres[1080:] == 0).all()
+    assert (depthLookUp[1085:NO_READING] < 0).all()
+
+
+def test_values_past_table_are_no_reading():
+    rawDepth = np.array([[0, 600, NO_READING, 4095]], dtype=np.uint16)
+    assert createDepthArray(rawDepth)[0, 3] == 0.0
+    assert rawDepthToMillimetres(rawDepth)[0].tolist() == [depthLookUpMillimetres[0], depthLookUpMillimetres[600], 0, 0]
+
+
+@pytest.mark.parametrize("step", [1, 2, 4])
+def test_depth_to_world_matches_sketch(step):
+    rng = np.random.default_rng(step)
+    fullFrame = rawFrame(rng)
+    rawDepth = fullFrame[::step, ::step]
+    verts = depthToWorld(rawDepth, step)
+    assert verts.dtype == np.float32
+    assert verts.shape == (rawDepth.size, 3)
+
+    verts = verts.reshape(rawDepth.shape + (3,))
+    for _ in range(200):
+        row, col = rng.integers(0, rawDepth.shape[0]), rng.integers(0, rawDepth.shape[1])
+        expected = sketchDepthToWorld(col * step, row * step, int(rawDepth[row, col]))
+        np.testing.assert_allclose(verts[row, col], expected, rtol=1e-5, atol=1e-7)
+
+
+def test_kinect_recording_frames(tmp_path):
+    rng = np.random.default_rng(0)
+    rawDepth = np.stack([rawFrame(rng) for _ in range(3)])
+    path = str(tmp_path / "walk.npz")
+    np.savez(path, raw_depth=rawDepth, timestamps=np.array([0.0, 40.0, 75.0]))
+
+    frames = list(openRecording(path, 2))
+    assert [frame[0] for frame in frames] == [0, 1, 2]
+    assert [frame[1] for frame in frames] == [0.0, 40.0, 75.0]
+    for frameIndex, timestamp, depth_image, depth_scale in frames:
+        assert depth_image.dtype == np.uint16
+        assert depth_image.shape == (KINECT_HEIGHT // 4, KINECT_WIDTH // 4)
+        assert depth_scale == 0.001
+        assert (depth_image == depthLookUpMillimetres[rawDepth[frameIndex, ::4, ::4]]).all()